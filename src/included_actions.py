@@ -1,18 +1,23 @@
 # this file is for the prebuilt actions and should be used as a reference to create more
+from typing import Optional
 
 
 async def basic_rest_request(
-    data: str, url: str, method: str = "GET", scheme: str = "<data>"
+    data: bytes,
+    url: Optional[str] = None,
+    method: str = "GET",
+    scheme: bytes = b"<data>",
 ):
     """Sends a rest request to URL using MEtHOD. Will replace '<data>'
-    with the provided data.
+    with the provided data. Actions only pass the data, bind the other
+    arguments with functools.partial.
 
     Args:
-        data (str): The data to send
-        url (str): The URL of the rest endpoint
+        data (bytes): The output line to send, after the removal steps
+        url (str, optional): The URL of the rest endpoint. Defaults to None.
         method (str, optional): The HTTP method to use. (GET, POST, etc).
         Defaults to "GET".
-        scheme (str, optional): The data to send in the payload of the rest request.
-        Defaults to "<data>".
+        scheme (bytes, optional): The data to send in the payload of the rest
+        request. Defaults to b"<data>".
     """
     pass
@@ -2,13 +2,155 @@ import asyncio
 import json
 import yaml
 import logging
-from re import match, sub, compile, Pattern
+import os
+import signal
+from sys import version_info
+from re import compile, error as PatternError, Pattern, IGNORECASE, VERBOSE
+from collections import deque
+from functools import lru_cache, partial
 from importlib import import_module
-from typing import Callable
+from inspect import iscoroutinefunction
+from operator import methodcaller
+from typing import AsyncIterator, Awaitable, Callable, Optional, Sequence, Union
+
+# Use libyaml's loader when PyYAML was built with it, it is much faster
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
 
+# The amount of data requested from a pipe per read. Reading in chunks and
+# splitting the lines ourselves lets a single read return many lines.
+READ_SIZE = 1 << 16
+# The size of the asyncio stream buffers, and a pipe size to pass to Manager.
+PIPE_SIZE = 1 << 18
+# The most queued input that is joined into a single write to stdin.
+WRITE_SIZE = 1 << 16
+# The stdin buffer size where drain starts waiting and the size it waits for.
+WRITE_BUFFER_HIGH = 1 << 20
+WRITE_BUFFER_LOW = 1 << 18
+# The default for the most lines an output queue keeps for the reader.
+QUEUE_SIZE = 1024
+# The seconds aclose waits for the process to exit before killing it.
+EXIT_TIMEOUT = 5
+
+_METACHARACTERS = frozenset(b".^$*+?{}[]\\|()")
+_QUANTIFIERS = frozenset(b"*+?{")
+# Pattern syntax that matches differently on text than on bytes: Unicode
+# classes, escapes for characters outside ASCII, anything matching a single
+# character that may be multibyte in UTF-8, and the IGNORECASE and UNICODE
+# flags. Other escapes are matched too so an escaped "." or "[" is skipped.
+_UNICODE_SENSITIVE = compile(
+    r"\\(?:([wWdDsSbBuUN]|x[89a-fA-F]|[23][0-7]{2})|.)|(\.|\[\^|\(\?[a-zA-Z-]*[iu])"
+)
+
+
+def _pattern_bytes(pattern: Pattern) -> bytes:
+    """Returns the text of a pattern as bytes, str patterns are encoded as UTF-8.
+
+    Args:
+        pattern (Pattern): The compiled pattern.
+
+    Returns:
+        bytes: The text of the pattern.
+    """
+    text = pattern.pattern
+    return text.encode() if isinstance(text, str) else text
+
+
+def _decode(data: bytes) -> str:
+    """Decodes output for a str pattern, bytes that are not valid UTF-8 are kept
+    as surrogates so encoding the result gives them back unchanged.
+
+    Args:
+        data (bytes): The output to decode.
+
+    Returns:
+        str: The decoded output.
+    """
+    return data.decode(errors="surrogateescape")
+
+
+def _is_byte_safe(pattern: str) -> bool:
+    """Checks if a pattern matches UTF-8 output the same as bytes as it does
+    as text.
+
+    Args:
+        pattern (str): The pattern text from the config.
+
+    Returns:
+        bool: True if the pattern can be compiled as a bytes pattern.
+    """
+    if not pattern.isascii():
+        return False
+    return not any(
+        match.lastindex for match in _UNICODE_SENSITIVE.finditer(pattern)
+    )
+
+
+def _is_literal(pattern: Pattern) -> bool:
+    """Checks if a pattern only matches its own text, so it can be handled
+    with bytes methods instead of the regex engine.
+
+    Args:
+        pattern (Pattern): The compiled pattern to check.
+
+    Returns:
+        bool: True if the pattern has no metacharacters or flags changing its text.
+    """
+    if pattern.flags & (IGNORECASE | VERBOSE):
+        return False
+    return _METACHARACTERS.isdisjoint(_pattern_bytes(pattern))
+
+
+@lru_cache(maxsize=1024)
+def _compile_pattern(pattern: str) -> Pattern:
+    """Compiles a pattern from a config as a bytes pattern. Patterns that match
+    differently on bytes, like \\w, "." or IGNORECASE, or that are only valid
+    as text are compiled as str patterns instead. The compiled patterns are
+    cached so actions repeating a pattern share one.
+
+    Args:
+        pattern (str): The pattern text from the config.
+
+    Returns:
+        Pattern: The compiled bytes or str pattern.
+    """
+    if _is_byte_safe(pattern):
+        try:
+            return compile(pattern.encode())
+        except PatternError:
+            pass
+    return compile(pattern)
+
+
+def _literal_prefix(pattern: Pattern) -> bytes:
+    """Finds the text every match of the pattern has to start with, so data
+    without it can be skipped before running the regex engine.
+
+    Args:
+        pattern (Pattern): The compiled pattern to check.
+
+    Returns:
+        bytes: The required prefix, empty if the pattern does not have one.
+    """
+    # The pattern is scanned as written, a str pattern is only encoded at the end
+    # so a quantifier drops a whole character and not the last byte of one
+    text = pattern.pattern
+    if pattern.flags & (IGNORECASE | VERBOSE) or b"|" in _pattern_bytes(pattern):
+        return b""
+    end = 0
+    while end < len(text) and ord(text[end : end + 1]) not in _METACHARACTERS:
+        end += 1
+    # A quantifier makes the character before it optional or repeated
+    if end < len(text) and ord(text[end : end + 1]) in _QUANTIFIERS:
+        end -= 1
+    prefix = text[: max(end, 0)]
+    return prefix.encode() if isinstance(prefix, str) else prefix
+
 
 class Action(object):
     def __init__(
@@ -17,39 +159,141 @@ class Action(object):
         self._condition = condition
         self._callable = action_callable
         self._remove_patterns = remove_patterns
-        self._actions = []
+        # Literal patterns skip the regex engine, a literal condition is a prefix
+        # check since match() is anchored to the start of the data. Other
+        # conditions are only run on data starting with their literal prefix.
+        # A literal is matched the same on the encoded output, only str patterns
+        # using the regex engine need the output decoded.
+        self._prefix = b""
+        if _is_literal(condition):
+            self._match = methodcaller("startswith", _pattern_bytes(condition))
+        else:
+            self._prefix = _literal_prefix(condition)
+            if isinstance(condition.pattern, str):
+                self._match = lambda data: condition.match(_decode(data))
+            else:
+                self._match = condition.match
+        self._removers = [Action._remover(pattern) for pattern in remove_patterns]
+        # perform_action is a coroutine function when the callable is one
+        self.is_async = iscoroutinefunction(action_callable)
+        self.perform_action = self._build_perform_action()
 
-    async def perform_action(self, data: bytes = b""):
-        """This function will test the data against the condtion.
-        If it matches, it will perform removal steps and pass it to the callable.
+    @staticmethod
+    def _remover(pattern: Pattern) -> Callable[[bytes], bytes]:
+        """Builds the function removing the matches of a pattern from the data.
 
         Args:
-            data (bytes, optional): This value is the data that will be checked against
-            the condition. Defaults to b"".
+            pattern (Pattern): The compiled bytes or str pattern to remove.
+
+        Returns:
+            Callable[[bytes], bytes]: The function removing the matches.
+        """
+        if _is_literal(pattern):
+            return methodcaller("replace", _pattern_bytes(pattern), b"")
+        if isinstance(pattern.pattern, str):
+            return lambda data: pattern.sub("", _decode(data)).encode(
+                errors="surrogateescape"
+            )
+        return partial(pattern.sub, b"")
+
+    def _build_perform_action(self) -> Callable[[bytes], Optional[bytes]]:
+        """Builds perform_action for this action, with the patterns and the
+        callable bound in its closure instead of looked up on every call.
+        For a coroutine function callable, perform_action awaits it and has to
+        be awaited itself.
+
+        Returns:
+            Callable[[bytes], Optional[bytes]]: The perform_action function.
         """
-        decoded_data = data.decode()
-        if match(self._condition, decoded_data):
-            for pattern in self._remove_patterns:
-                decoded_data = sub(pattern=pattern, repl="", string=decoded_data)
-            self._callable(decoded_data)
+        prefix = self._prefix
+        match = self._match
+        removers = tuple(self._removers)
+        action_callable = self._callable
+
+        if self.is_async:
+
+            async def perform_async_action(data: bytes = b"") -> Optional[bytes]:
+                if prefix and not data.startswith(prefix):
+                    return None
+                if match(data):
+                    for remover in removers:
+                        data = remover(data)
+                    await action_callable(data)
+                    return data
+                return None
+
+            return perform_async_action
+
+        def perform_action(data: bytes = b"") -> Optional[bytes]:
+            """This function will test the data against the condtion.
+            If it matches, it will perform removal steps and pass it to the callable.
+            The callable is passed bytes, the data is only decoded as UTF-8 for
+            str patterns.
+
+            Args:
+                data (bytes, optional): This value is the data that will be checked
+                against the condition. Defaults to b"".
+
+            Returns:
+                Optional[bytes]: The data after the removal steps if the condition
+                matched, otherwise None.
+            """
+            if prefix and not data.startswith(prefix):
+                return None
+            if match(data):
+                for remover in removers:
+                    data = remover(data)
+                action_callable(data)
+                return data
+            return None
+
+        return perform_action
 
 
 class Actions(object):
+    def __init__(self) -> None:
+        self._actions = []
+
     async def register_actions(self, actions: list = []) -> None:
-        """This function will compile all patterns, import the callable,
-        and keep track of the actions.
+        """This function will compile all patterns, import the callable given as
+        "module:function", and keep track of the actions. Patterns are compiled
+        as bytes patterns where they match the same as text, so they can run on
+        the output without decoding it. The callables are passed bytes.
+        The remove patterns are applied in order, unless "join_remove_patterns"
+        is set to remove them all in one pass.
 
         Args:
             actions (list, optional): This should  be a list of action dicts.
             Defaults to [].
         """
         for action in actions:
-            action_condition = compile(action["condition"])
-            action_remove_patterns = []
-            if precompiled_patterns := action.get("remove_patterns"):
-                for precompiled_patttern in precompiled_patterns:
-                    action_remove_patterns.append(compile(precompiled_patttern))
-            action_callable = import_module(action["callable"])
+            action_condition = _compile_pattern(action["condition"])
+            action_remove_patterns = [
+                _compile_pattern(precompiled_pattern)
+                for precompiled_pattern in action.get("remove_patterns", [])
+            ]
+            # The patterns are removed one after another, removing one can expose
+            # a match for the next. With join_remove_patterns set they are joined
+            # into one alternation instead, a single pass over the data. Patterns
+            # with groups are kept apart, joining them renumbers backreferences
+            # and repeats group names.
+            if (
+                action.get("join_remove_patterns")
+                and len(action_remove_patterns) > 1
+                and not any(pattern.groups for pattern in action_remove_patterns)
+            ):
+                try:
+                    action_remove_patterns = [
+                        _compile_pattern(
+                            "|".join(
+                                f"(?:{precompiled_pattern})"
+                                for precompiled_pattern in action["remove_patterns"]
+                            )
+                        )
+                    ]
+                except PatternError:
+                    pass
+            action_callable = await self._register_callable(action["callable"])
             self._actions.append(
                 Action(
                     condition=action_condition,
@@ -60,78 +304,245 @@ class Actions(object):
 
     async def perform_actions(self, data: bytes = b""):
         """This function will call perform_action and pass data on all registed actions.
+        An action raising is logged, it does not stop the other actions.
 
         Args:
             data (bytes, optional): This is the value to run the actions on.
             Defaults to b"".
         """
-        for action in self._actions:
-            await action.perform_action(data)
+        actions = self._actions
+        if not actions:
+            return
+        for action in actions:
+            try:
+                if action.is_async:
+                    await action.perform_action(data)
+                else:
+                    action.perform_action(data)
+            except Exception:
+                logger.exception("Action has failed on %r", data)
 
     async def _register_callable(self, file_function: str) -> Callable:
-        pass
-        # spec = ilu.spec_from_file_location(file, folder)
-        # callable_lib = ilu.module_from_spec(spec)
-        # spec.loader.exec_module(callable_lib)
+        """Imports the callable of an action, given as "module:function".
+
+        Args:
+            file_function (str): The module and the name of the callable in it.
+
+        Raises:
+            ValueError: If the callable is not given as "module:function".
+
+        Returns:
+            Callable: The callable the actions will pass the data to.
+        """
+        module_name, _, function_name = file_function.partition(":")
+        if not module_name or not function_name:
+            raise ValueError(
+                f'"{file_function}" is not a valid callable. (module:function)'
+            )
+        return getattr(import_module(module_name), function_name)
+
+
+class LineQueue(object):
+    """A bounded queue of lines for a single runner and a single reader.
+    It is lighter than asyncio.Queue, only two events are used for waiting.
+    put waits for the reader when the queue is full, put_nowait drops the
+    oldest line instead and counts it in dropped. A maxsize of 0 or less makes
+    the queue unbounded. Once closed, get returns an empty byte string after the
+    queued lines.
+    """
+
+    __slots__ = ("_lines", "_ready", "_space", "_closed", "dropped")
+
+    def __init__(self, maxsize: int = QUEUE_SIZE) -> None:
+        self._lines = deque(maxlen=maxsize if maxsize > 0 else None)
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closed = False
+        self.dropped = 0
+
+    async def put(self, data: bytes) -> None:
+        while len(self._lines) == self._lines.maxlen:
+            self._space.clear()
+            await self._space.wait()
+        self._lines.append(data)
+        self._ready.set()
+
+    def put_nowait(self, data: bytes) -> None:
+        if len(self._lines) == self._lines.maxlen:
+            # Only the first line dropped is logged, this runs once per line when
+            # nothing reads the queue
+            if not self.dropped:
+                logger.warning("Queue is full, dropping the oldest lines")
+            self.dropped += 1
+        self._lines.append(data)
+        self._ready.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._ready.set()
+
+    async def get(self) -> bytes:
+        while not self._lines:
+            if self._closed:
+                return b""
+            self._ready.clear()
+            await self._ready.wait()
+        self._space.set()
+        return self._lines.popleft()
 
 
 class Manager(object):
     def __init__(
-        self, cmd, manage_stdin: bool = False, dedicated_stderr: bool = False
+        self,
+        cmd: Union[str, Sequence[str]],
+        manage_stdin: bool = False,
+        dedicated_stderr: bool = False,
+        on_line: Optional[Callable[[bytes], Awaitable[None]]] = None,
+        queue_size: int = QUEUE_SIZE,
+        pipe_size: Optional[int] = None,
     ) -> None:
         self._cmd = cmd
         self._manage_stdin = manage_stdin
         self._dedicated_stderr = dedicated_stderr
+        self._queue_size = queue_size
+        # Resizing the pipes is opt-in, it fails with EPERM once the user is over
+        # /proc/sys/fs/pipe-user-pages-soft
+        self._pipe_size = pipe_size
+        # When set, output lines are awaited with this instead of being queued
+        self._on_line = on_line
         self._process = None
+        self._process_group = False
+        self._output_task = None
+        self._error_task = None
+        self._input_task = None
+
+    async def __aenter__(self) -> "Manager":
+        await self.start()
+        return self
 
-    def __del__(self):
-        if self._process is not None and self._process.returncode is None:
-            logger.debug("Killing the process")
-            self._process.kill()
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Terminates the process if it is still running, waits for it to exit
+        and cancels the runner tasks.
+        """
+        if self._process is None:
+            return
+        logger.debug("Terminating the process")
+        self._signal_process(kill=False)
+        try:
+            await asyncio.wait_for(self._process.wait(), EXIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("The process did not exit, killing it")
+            self._signal_process(kill=True)
+            try:
+                await asyncio.wait_for(self._process.wait(), EXIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("The process did not exit after being killed")
+        tasks = [
+            task
+            for task in (self._output_task, self._error_task, self._input_task)
+            if task is not None
+        ]
+        # An output runner cancelled here has not sent the end of the output
+        output_ended = self._output_task.done()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # End the queue for it so a reader waiting on read() is released, closing
+        # the queue does not drop unread lines like putting to a full one does
+        if not output_ended:
+            self._output_queue.close()
+        logger.debug("Closed the process and the task(s)")
+
+    def _signal_process(self, kill: bool) -> None:
+        """Terminates or kills the process if it has not been reaped yet. When
+        the process has its own group the whole group is signaled, children left
+        behind by a shell keep the pipes open and wait() only returns once they
+        close.
+
+        Args:
+            kill (bool): Kill the process instead of terminating it.
+        """
+        # Once the process is reaped its pid, and so its group id, can be reused
+        # by an unrelated process
+        if self._process.returncode is not None:
+            return
+        try:
+            if os.name == "posix":
+                # Signaling the pid avoids terminate() reaping an exited process
+                # behind the child watcher, which loses its return code
+                sig = signal.SIGKILL if kill else signal.SIGTERM
+                if self._process_group:
+                    os.killpg(self._process.pid, sig)
+                else:
+                    os.kill(self._process.pid, sig)
+            elif kill:
+                self._process.kill()
+            else:
+                self._process.terminate()
+        except ProcessLookupError:
+            pass
 
     async def start(self) -> None:
-        # This will initallize the stderr and stdin with PIPEs
-        if self._dedicated_stderr and self._manage_stdin:
-            self._process = await asyncio.subprocess.create_subprocess_shell(
-                self._cmd,
-                stderr=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stdin=asyncio.subprocess.PIPE,
-            )
-        # This one just sets the stderr and stdout to PIPEs
-        elif self._dedicated_stderr:
-            self._process = await asyncio.subprocess.create_subprocess_shell(
-                self._cmd,
-                stderr=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-            )
-        # This one is just for PIPEing the stdin
-        elif self._manage_stdin:
+        # stdout is always a PIPE, stderr is either its own PIPE or sent to stdout
+        # and stdin is only a PIPE when it is managed
+        options = {
+            "stdout": asyncio.subprocess.PIPE,
+            "stderr": asyncio.subprocess.PIPE
+            if self._dedicated_stderr
+            else asyncio.subprocess.STDOUT,
+        }
+        if self._manage_stdin:
+            options["stdin"] = asyncio.subprocess.PIPE
+        # Only the stock event loop passes process_group and pipesize on to Popen,
+        # uvloop rejects them
+        stock_loop = isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop)
+        # With a managed stdin the process gets its own group so aclose can stop
+        # its children as well. Otherwise it stays in the foreground group, in a
+        # background group reading the terminal would stop it with SIGTTIN and
+        # Ctrl-C would not reach it.
+        self._process_group = os.name == "posix" and self._manage_stdin
+        if self._process_group:
+            if version_info >= (3, 11) and stock_loop:
+                options["process_group"] = 0
+            else:
+                options["preexec_fn"] = os.setpgrp
+        # Larger pipes and stream buffers let each read return more at once
+        options["limit"] = PIPE_SIZE
+        if self._pipe_size and version_info >= (3, 10) and stock_loop:
+            options["pipesize"] = self._pipe_size
+        # A list of arguments is run directly, a string still goes through the shell
+        if isinstance(self._cmd, str):
             self._process = await asyncio.subprocess.create_subprocess_shell(
-                self._cmd,
-                stderr=asyncio.subprocess.STDOUT,
-                stdout=asyncio.subprocess.PIPE,
-                stdin=asyncio.subprocess.PIPE,
+                self._cmd, **options
             )
-        # This one does not create dedicated PIPEs for stdin or stderr.
         else:
-            self._process = await asyncio.subprocess.create_subprocess_shell(
-                self._cmd,
-                stderr=asyncio.subprocess.STDOUT,
-                stdout=asyncio.subprocess.PIPE,
+            self._process = await asyncio.subprocess.create_subprocess_exec(
+                *self._cmd, **options
             )
 
         logger.info(f'Created the process: "{self._process}"')
+        if self._manage_stdin:
+            # Let more input sit in the transport before drain has to wait
+            self._process.stdin.transport.set_write_buffer_limits(
+                high=WRITE_BUFFER_HIGH, low=WRITE_BUFFER_LOW
+            )
         # Create the queues
-        self._output_queue = asyncio.Queue()
-        self._error_queue = asyncio.Queue()
+        # The output queues are bounded so they can not grow without limit. The
+        # output runner waits for the reader, but nothing reads the error queue
+        # so the error runner drops the oldest lines instead.
+        self._output_queue = LineQueue(self._queue_size)
+        self._error_queue = LineQueue(self._queue_size)
         self._input_queue = asyncio.Queue()
         logger.info("Created the queues")
         # create the tasks
         self._output_task = asyncio.create_task(
-            Manager.output_runner(self._process, self._output_queue)
+            Manager.output_runner(self._process, self._output_queue, self._on_line)
         )
         if self._dedicated_stderr:
+            assert self._process.stderr is not None
             self._error_task = asyncio.create_task(
                 Manager.error_runner(self._process, self._error_queue)
             )
@@ -146,40 +557,84 @@ class Manager(object):
 
     async def write(self, data: bytes = b"\r\n"):
         if self._process.returncode is None:
-            if data.endswith(b"\r\n"):
-                await self._input_queue.put(data)
+            # The input queue is unbounded, so putting never has to wait
+            self._input_queue.put_nowait(data)
+
+    async def close_stdin(self) -> None:
+        """Stops the input runner once the input queued before this call is written,
+        then closes stdin so the process reads the end of its input."""
+        if self._manage_stdin:
+            self._input_queue.put_nowait(None)
+
+    @staticmethod
+    async def read_lines(stream: asyncio.StreamReader) -> AsyncIterator[bytes]:
+        """Reads a stream in chunks and yields the lines in them, the last line
+        is yielded without a line ending if the stream does not end with one.
+
+        Args:
+            stream (asyncio.StreamReader): The stream to read the lines from.
+        """
+        # The same buffer is reused for every read to keep partial lines
+        buffer = bytearray()
+        while True:
+            chunk = await stream.read(READ_SIZE)
+            if not chunk:
+                break
+            # The chunk is only copied into the buffer when a partial line is
+            # waiting there, otherwise lines are taken from the chunk itself
+            if buffer:
+                buffer += chunk
+                chunk = buffer
+            # Scan forward from the last line instead of removing every line
+            # from the front, the buffer is only shifted once per read. Lines
+            # are copied straight out of the buffer through a view, slicing
+            # the bytearray itself would make an extra copy.
+            start = 0
+            with memoryview(chunk) as view:
+                while end := chunk.find(b"\n", start) + 1:
+                    data = view[start:end].tobytes()
+                    start = end
+                    yield data
+            if chunk is buffer:
+                del buffer[:start]
             else:
-                await self._input_queue.put(data + b"\r\n")
+                buffer += chunk[start:]
+        if buffer:
+            yield bytes(buffer)
 
     @staticmethod
-    async def output_runner(proc: asyncio.subprocess.Process, queue: asyncio.Queue):
+    async def output_runner(
+        proc: asyncio.subprocess.Process,
+        queue: "LineQueue",
+        on_line: Optional[Callable[[bytes], Awaitable[None]]] = None,
+    ):
         logger.debug("Output runner has started")
-        while proc.returncode is None:
-            data = await proc.stdout.readline()
-            if not data:
-                break
-            try:
-                await queue.put(data)
-            except asyncio.QueueFull:
-                logger.warning(f'Output queue is full, removing "{await queue.get()}"')
-                await queue.put(data)
-        await queue.put(b"")
-        logger.debug("Output runner has finished, sending empty byte string")
+        # Lines go straight to on_line if given, skipping the hop through the queue
+        emit = queue.put if on_line is None else on_line
+        cancelled = False
+        try:
+            async for data in Manager.read_lines(proc.stdout):
+                await emit(data)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            logger.exception("Output runner has failed")
+            raise
+        finally:
+            # The end of the output is sent even if reading or on_line failed so
+            # read() does not wait forever, a cancelled runner leaves it to aclose
+            if not cancelled:
+                await queue.put(b"")
+                logger.debug("Output runner has finished, sending empty byte string")
 
     @staticmethod
-    async def error_runner(proc: asyncio.subprocess.Process, queue: asyncio.Queue):
+    async def error_runner(proc: asyncio.subprocess.Process, queue: "LineQueue"):
         logger.info("Error runner has started")
-        while proc.returncode is None:
-            data = await proc.stdout.readline()
-            if not data:
-                break
-            logger.debug(f'Error runner: "{data}"')
-
-            try:
-                await queue.put(data)
-            except asyncio.QueueFull:
-                logger.warning(f'Error queue is full, removing "{await queue.get()}"')
-                await queue.put(data)
+        async for data in Manager.read_lines(proc.stderr):
+            # Formatting is left to logging so it is skipped when debug is off
+            logger.debug('Error runner: "%s"', data)
+            queue.put_nowait(data)
         logger.info("Error runner has finished")
 
     @staticmethod
@@ -187,23 +642,44 @@ class Manager(object):
         proc: asyncio.subprocess.Process, queue: asyncio.Queue, delay: float = 0
     ):
         logger.info("Input runner has started")
-        while proc.returncode is None:
-            if queue.qsize() > 0:
-                data = await queue.get()
+        # Waiting on the queue parks the runner until there is input, None is
+        # put on the queue by Manager.close_stdin or when the process exits to stop it
+        exit_task = asyncio.create_task(proc.wait())
+        exit_task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (data := await queue.get()) is not None:
+                # Anything else already queued goes out in the same write and drain.
+                # Missing line endings are added to the batch here, so the join is
+                # the only copy made of the input.
+                batch = []
+                size = 0
+                while True:
+                    batch.append(data)
+                    size += len(data)
+                    if not data.endswith(b"\r\n"):
+                        batch.append(b"\r\n")
+                    if size >= WRITE_SIZE or queue.empty():
+                        break
+                    if (data := queue.get_nowait()) is None:
+                        break
                 if proc.stdin.is_closing():
                     break
-                else:
-                    proc.stdin.write(data)
-                    await proc.stdin.drain()
-            else:
-                await asyncio.sleep(0)
+                proc.stdin.write(b"".join(batch))
+                await proc.stdin.drain()
+                if data is None:
+                    break
+        finally:
+            # Cancelled or not, the wait on the process should not outlive the runner
+            exit_task.cancel()
+            # Closing stdin sends EOF, nothing else is written once the runner stops
+            proc.stdin.close()
         logger.info("Input runner has finished")
 
 
 async def load_config(config_path: str) -> dict:
     with open(config_path, "r") as config_file:
         if config_path.endswith(".yml"):
-            return yaml.safe_load(config_file)
+            return yaml.load(config_file, Loader=SafeLoader)
         elif config_path.endswith(".json"):
             return json.load(config_file)
         else:
@@ -212,31 +688,11 @@ async def load_config(config_path: str) -> dict:
             )
 
 
-# This is the legacy action system. Kept in for reference. \
-# However, will remove eventually
-# async def perform_action(action: dict = {}, data: str = "") -> None:
-#     if "condition" in action.keys() and match(action["condition"], data):
-#         logger.debug("action condition matches data")
-#         if "remove_steps" in action.keys():
-#             logger.debug(
-#                 f"Found remove_steps: " f" {len(action['remove_steps'])} steps"
-#             )
-#             for remove_step in action["remove_steps"]:
-#                 # pass the execution to the loop
-#                 await asyncio.sleep(0)
-#                 # if the remove step matches, remove the match.
-#                 pre_data = data
-#                 data = sub(remove_step, "", data)
-#                 # helps debug steps
-#                 if data == pre_data:
-#                     logger.warning(f'"{remove_step}" had no effect')
-
-
 if __name__ == "__main__":
 
-    async def main():
+    async def main() -> int:
         logger.setLevel(logging.DEBUG)
-        from sys import argv
+        from sys import argv, stdout
 
         if len(argv) > 1:
             config = await load_config(argv[1])
@@ -245,14 +701,34 @@ if __name__ == "__main__":
                 r"C:\Users\jbloo\Documents\Git\proman_core\config.json"
             )
         # create and register the actions stored in the config
-
-        proc = Manager(config["command"])
-        await proc.start()
-        while data := await proc.read():
-            if data:
-                data = data.decode()
-                # await perform_action(action=config["action"], data=data)
-                print(data, end="")
+        actions = Actions()
+        await actions.register_actions(config.get("actions", []))
+
+        # Flushing every line is only needed when someone is watching the output
+        output = stdout.buffer
+        interactive = stdout.isatty()
+
+        async def on_line(data: bytes) -> None:
+            output.write(data)
+            if interactive:
+                output.flush()
+            await actions.perform_actions(data)
+
+        async with Manager(config["command"], on_line=on_line) as proc:
+            # The output is handled by on_line, this only waits for the end of it
+            await proc.read()
+        output.flush()
         logger.debug("Main function has stopped the loop")
-
-    asyncio.run(main())
+        # The output runner failing cuts the output short, report it in the exit code
+        output_task = proc._output_task
+        if not output_task.cancelled() and output_task.exception() is not None:
+            return 1
+        return 0
+
+    # uvloop's event loop does less work per pipe read, use it when installed
+    try:
+        import uvloop
+    except ImportError:
+        exit(asyncio.run(main()))
+    else:
+        exit(uvloop.run(main()))
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import procore  # noqa: E402
+from procore import (  # noqa: E402
+    Action,
+    Actions,
+    LineQueue,
+    Manager,
+    _compile_pattern,
+    _is_literal,
+    _literal_prefix,
+    _pattern_bytes,
+)
+
+# The pieces random patterns are built from, with literals, metacharacters,
+# escapes and text that is not ASCII
+PATTERN_TOKENS = [
+    "a", "b", "ab", "é", ".", "*", "+", "?", "|", "[ab]", "[^a]", r"\.",
+    "(a)", "(?:b)", "{2}", "^", "$", r"\w", r"\d", r"\xe9", "(?i)",
+]
+DATA_ALPHABET = ["a", "b", "A", ".", "é", "1", " "]
+# More lines than a default queue holds
+QUEUE_LINES = procore.QUEUE_SIZE * 2
+
+
+def random_patterns(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    patterns = []
+    while len(patterns) < count:
+        pattern = "".join(rng.choices(PATTERN_TOKENS, k=rng.randint(1, 4)))
+        try:
+            re.compile(pattern)
+        except re.error:
+            continue
+        patterns.append(pattern)
+    return patterns
+
+
+def random_data(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choices(DATA_ALPHABET, k=rng.randint(0, 6)))
+        for _ in range(count)
+    ]
+
+
+class TestPatterns(unittest.TestCase):
+    def setUp(self) -> None:
+        self.patterns = random_patterns(400)
+        self.data = random_data(200)
+
+    def test_literal_matches_like_re(self):
+        for pattern in self.patterns:
+            compiled = _compile_pattern(pattern)
+            if not _is_literal(compiled):
+                continue
+            for text in self.data:
+                with self.subTest(pattern=pattern, text=text):
+                    self.assertEqual(
+                        text.encode().startswith(_pattern_bytes(compiled)),
+                        bool(re.match(pattern, text)),
+                    )
+
+    def test_prefix_is_required_by_every_match(self):
+        for pattern in self.patterns:
+            prefix = _literal_prefix(_compile_pattern(pattern))
+            for text in self.data:
+                if re.match(pattern, text):
+                    with self.subTest(pattern=pattern, text=text):
+                        self.assertTrue(text.encode().startswith(prefix))
+
+    def test_action_matches_like_re_on_text(self):
+        for pattern in self.patterns:
+            action = Action(_compile_pattern(pattern), lambda data: None)
+            for text in self.data:
+                with self.subTest(pattern=pattern, text=text):
+                    self.assertEqual(
+                        action.perform_action(text.encode()) is not None,
+                        bool(re.match(pattern, text)),
+                    )
+
+    def test_patterns_only_valid_as_text_compile(self):
+        for pattern, text in [
+            (r"\N{EM DASH}", "—"),
+            (r"é", "é"),
+            (r"\U0001F600", "😀"),
+            ("(?u)foo", "foo"),
+            (r"caf\xe9", "café"),
+            ("a.b", "aéb"),
+            ("^.{3}$", "héé"),
+        ]:
+            with self.subTest(pattern=pattern):
+                action = Action(_compile_pattern(pattern), lambda data: None)
+                self.assertIsNotNone(action.perform_action(text.encode()))
+
+    def test_remove_patterns_are_applied_in_order(self):
+        actions = Actions()
+        asyncio.run(
+            actions.register_actions(
+                [
+                    {
+                        "condition": "",
+                        "remove_patterns": [r"\x1b\[[0-9;]*m", "^ +"],
+                        "callable": "builtins:print",
+                    }
+                ]
+            )
+        )
+        action = actions._actions[0]
+        self.assertEqual(action.perform_action(b"\x1b[31m  error: x"), b"error: x")
+
+
+class TestReadLines(unittest.TestCase):
+    def read_lines(self, chunks: list) -> list:
+        async def read() -> list:
+            stream = asyncio.StreamReader()
+            for chunk in chunks:
+                stream.feed_data(chunk)
+            stream.feed_eof()
+            return [line async for line in Manager.read_lines(stream)]
+
+        return asyncio.run(read())
+
+    def test_lines_split_across_chunks(self):
+        with mock.patch.object(procore, "READ_SIZE", 3):
+            lines = self.read_lines([b"ab", b"c\nde", b"f\n\ng", b"hi\n"])
+        self.assertEqual(lines, [b"abc\n", b"def\n", b"\n", b"ghi\n"])
+
+    def test_last_line_without_newline(self):
+        with mock.patch.object(procore, "READ_SIZE", 4):
+            lines = self.read_lines([b"one\ntw", b"o\nthree"])
+        self.assertEqual(lines, [b"one\n", b"two\n", b"three"])
+
+    def test_empty_stream(self):
+        self.assertEqual(self.read_lines([]), [])
+
+
+class TestLineQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_put_nowait_drops_oldest_when_full(self):
+        queue = LineQueue(2)
+        for line in (b"1", b"2", b"3", b"4"):
+            queue.put_nowait(line)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual([await queue.get(), await queue.get()], [b"3", b"4"])
+
+    async def test_put_waits_for_the_reader_when_full(self):
+        queue = LineQueue(1)
+        await queue.put(b"1")
+        put = asyncio.create_task(queue.put(b"2"))
+        await asyncio.sleep(0)
+        self.assertFalse(put.done())
+        self.assertEqual(await queue.get(), b"1")
+        await asyncio.wait_for(put, 1)
+        self.assertEqual(await queue.get(), b"2")
+
+    async def test_unbounded(self):
+        for maxsize in (0, -1):
+            queue = LineQueue(maxsize)
+            for line in range(QUEUE_LINES):
+                await asyncio.wait_for(queue.put(b"%d" % line), 1)
+            self.assertEqual(queue.dropped, 0)
+            self.assertEqual(await queue.get(), b"0")
+
+    async def test_closed_returns_queued_lines_then_end(self):
+        queue = LineQueue(2)
+        await queue.put(b"1")
+        queue.close()
+        self.assertEqual(await queue.get(), b"1")
+        self.assertEqual(await queue.get(), b"")
+        self.assertEqual(await queue.get(), b"")
+
+    async def test_close_releases_a_waiting_reader(self):
+        queue = LineQueue()
+        get = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        queue.close()
+        self.assertEqual(await asyncio.wait_for(get, 1), b"")
+
+
+@unittest.skipUnless(os.name == "posix", "signals the process with POSIX signals")
+class TestManager(unittest.IsolatedAsyncioTestCase):
+    async def test_aclose_kills_a_process_ignoring_sigterm(self):
+        cmd = [
+            sys.executable,
+            "-c",
+            "import signal, time;"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN);"
+            "print('ready', flush=True);"
+            "time.sleep(30)",
+        ]
+        with mock.patch.object(procore, "EXIT_TIMEOUT", 0.5):
+            async with Manager(cmd) as manager:
+                self.assertEqual(await manager.read(), b"ready\n")
+        self.assertEqual(manager._process.returncode, -9)
+
+    async def test_read_ends_after_the_output(self):
+        async with Manager("printf 'a\\nb'") as manager:
+            lines = [await manager.read() for _ in range(3)]
+        self.assertEqual(lines, [b"a\n", b"b", b""])
+
+    async def test_close_stdin_sends_eof(self):
+        async with Manager("cat", manage_stdin=True) as manager:
+            await manager.write(b"line")
+            await manager.close_stdin()
+            lines = [await asyncio.wait_for(manager.read(), 5) for _ in range(2)]
+        self.assertEqual(lines, [b"line\r\n", b""])
+
+
+if __name__ == "__main__":
+    unittest.main()